@@ -1,13 +1,17 @@
 #!/usr/bin/env python
+import argparse
 import os
 import struct
 import sys
+from array import array
 from dataclasses import dataclass
 from datetime import datetime
-from typing import List
+from typing import BinaryIO, Iterator, List, Optional
 
-import filetime
-from lz77 import lz_decompress
+from winfiletime import filetime
+
+from . import stats
+from .lz77 import lz_decompress
 
 
 @dataclass
@@ -38,30 +42,126 @@ class TOC:
 
 
 FILE_SUFFIX = "~"
+TOC_MAGIC = b"\x4e\xc6\x67\x18"
+TOC_RECORD = struct.Struct("<qq4i64s")
 
 
-def handle_files(cache, toc, outdir):
-	assert toc.read(4) == b"\x4e\xc6\x67\x18", "Invalid TOC MAGIC"
+class DirectoryTable:
+	"""
+	Directory index -> path table, stored as parent indices and offsets
+	into a shared buffer of names. Paths are rebuilt on demand.
+	"""
+
+	def __init__(self) -> None:
+		self.parents = array("l", [0])
+		self.name_offsets = array("q", [0, 0])
+		self.names = bytearray()
+
+	def __len__(self) -> int:
+		return len(self.parents)
+
+	def add(self, parent: int, name: bytes) -> int:
+		if not 0 <= parent < len(self.parents):
+			raise KeyError(parent)
+		self.parents.append(parent)
+		self.names += name
+		self.name_offsets.append(len(self.names))
+		return len(self.parents) - 1
+
+	def get_path(self, index: int) -> str:
+		if not 0 <= index < len(self.parents):
+			raise KeyError(index)
+		parts = []
+		while index:
+			parts.append(self.names[self.name_offsets[index]:self.name_offsets[index + 1]].decode())
+			index = self.parents[index]
+		return "/" + "/".join(reversed(parts))
+
+
+def read_toc_header(toc: BinaryIO) -> int:
+	assert toc.read(4) == TOC_MAGIC, "Invalid TOC MAGIC"
 	toc_version, = struct.unpack("<i", toc.read(4))
 	assert toc_version in (16, 20), f"Unreadable TOC version {toc_version}"
+	return toc_version
+
+
+def iter_toc_records(toc: BinaryIO, window_size: int = 1) -> Iterator[tuple]:
+	if window_size < 1:
+		raise ValueError(f"window_size must be positive, got {window_size}")
+	while True:
+		data = toc.read(TOC_RECORD.size * window_size)
+		if not data:
+			break
+		yield from TOC_RECORD.iter_unpack(data)
+
+
+def get_file_time(timestamp: int) -> Optional[datetime]:
+	if timestamp <= 0:
+		return None
+	return filetime.to_datetime(timestamp)
+
+
+def get_local_path(outdir: str, full_path: str) -> str:
+	return os.path.join(outdir, full_path.lstrip("/"))
+
+
+def read_entry_data(cache: BinaryIO, entry: TOCEntry) -> bytes:
+	cache.seek(entry.offset)
+	if entry.compressed_size != entry.size:
+		with stats.timer("cache.decompress_time", entry.full_path):
+			data = lz_decompress(cache, entry.size)
+		stats.incr("cache.bytes_decompressed", len(data))
+	else:
+		data = cache.read(entry.compressed_size)
+	stats.incr("cache.entries")
+	stats.incr("cache.bytes_read", entry.compressed_size)
+	stats.incr("cache.bytes_written", len(data))
+	stats.observe("cache.entry_size", entry.full_path, len(data))
+	return data
+
+
+def extract_entry(cache: BinaryIO, entry: TOCEntry, outdir: str) -> None:
+	if not entry.time:
+		print("Skipping entry without time", repr(entry))
+		return
+
+	local_path = get_local_path(outdir, entry.full_path)
+	if os.path.exists(local_path):
+		if os.path.isdir(local_path):
+			local_path = local_path + FILE_SUFFIX
+
+	print(f"Extracting {local_path} (compressed={entry.compressed_size != entry.size})")
+	data = read_entry_data(cache, entry)
+
+	if os.path.exists(local_path):
+		from hashlib import md5
+
+		local_path += f"~{md5(data).hexdigest()[:5]}"
+
+	try:
+		with open(local_path, "wb") as f:
+			f.write(data)
+	except OSError as e:
+		sys.stderr.write(f"Cannot write {entry.full_path} - {e.strerror}\n")
+		return
+
+	# Set write time to the entry's filetime
+	if entry.time:
+		ts = entry.time.timestamp()
+		os.utime(local_path, (ts, ts))
+
+
+def handle_files(cache, toc, outdir):
+	read_toc_header(toc)
 
 	directories = {0: "/"}
 	directory_index = 0
 
 	entries = []
 
-	while True:
-		data = toc.read(8 + 8 + 4 + 4 + 4 + 4 + 64)
-		if not data:
-			break
-		offset, timestamp, compressed_size, size, scope_index, parent, filename = struct.unpack(
-			"<qq4i64s", data
-		)
+	for offset, timestamp, compressed_size, size, scope_index, parent, filename in iter_toc_records(toc):
 		filename = filename.rstrip(b"\0").decode()
-		if timestamp <= 0:
-			file_time = None
-		else:
-			file_time = filetime.to_datetime(timestamp)
+		file_time = get_file_time(timestamp)
 
 		if offset == -1:
 			path = directories[parent]
@@ -74,61 +174,93 @@ def handle_files(cache, toc, outdir):
 			offset, file_time, compressed_size, size, scope_index, path, filename
 		)
 		entries.append(entry)
-
-	def get_local_path(full_path: str) -> str:
-		return os.path.join(outdir, full_path.lstrip("/"))
+		stats.incr("toc.records")
 
 	for directory in directories.values():
-		path = get_local_path(directory)
+		path = get_local_path(outdir, directory)
 		if not os.path.exists(path):
 			os.makedirs(path)
 
 	for entry in entries:
 		if entry.is_directory:
 			continue
-		if not entry.time:
-			print("Skipping entry without time", repr(entry))
-			continue
+		extract_entry(cache, entry, outdir)
 
-		local_path = get_local_path(entry.full_path)
-		if os.path.exists(local_path):
-			if os.path.isdir(local_path):
-				local_path = local_path + FILE_SUFFIX
 
-		cache.seek(entry.offset)
-		compressed = entry.compressed_size != entry.size
-		print(f"Extracting {local_path} (compressed={compressed})")
-		if compressed:
-			data = lz_decompress(cache, entry.size)
-		else:
-			data = cache.read(entry.compressed_size)
-
-		if os.path.exists(local_path):
-			from hashlib import md5
+def handle_files_streaming(cache: BinaryIO, toc: BinaryIO, outdir: str, window_size: int = 4096) -> None:
+	"""
+	Same as handle_files(), but the TOC is read `window_size` records at a
+	time and files are extracted as they are read. Only the directory table
+	is kept in memory. The TOC must be seekable: directories are all created
+	in a first pass, so that files colliding with them get the same `~`
+	suffix as with handle_files().
+	"""
+	if window_size < 1:
+		raise ValueError(f"window_size must be positive, got {window_size}")
+	read_toc_header(toc)
+	records_start = toc.tell()
 
-			local_path += f"~{md5(data).hexdigest()[:5]}"
+	directories = DirectoryTable()
+	os.makedirs(outdir, exist_ok=True)
+	for offset, _, _, _, _, parent, filename in iter_toc_records(toc, window_size):
+		stats.incr("toc.records")
+		if offset == -1:
+			index = directories.add(parent, filename.rstrip(b"\0"))
+			os.makedirs(get_local_path(outdir, directories.get_path(index)), exist_ok=True)
 
-		try:
-			with open(local_path, "wb") as f:
-				f.write(data)
-		except OSError as e:
-			sys.stderr.write(f"Cannot write {entry.full_path} - {e.strerror}\n")
+	toc.seek(records_start)
+	# Files of the same directory are usually next to each other
+	last_parent, last_path = -1, ""
+	for record in iter_toc_records(toc, window_size):
+		offset, timestamp, compressed_size, size, scope_index, parent, filename = record
+		if offset == -1:
 			continue
+		if parent != last_parent:
+			last_parent, last_path = parent, directories.get_path(parent)
+
+		entry = TOCEntry(
+			offset, get_file_time(timestamp), compressed_size, size, scope_index,
+			last_path, filename.rstrip(b"\0").decode()
+		)
+		extract_entry(cache, entry, outdir)
+
 
-		# Set write time to the entry's filetime
-		if entry.time:
-			ts = entry.time.timestamp()
-			os.utime(local_path, (ts, ts))
+def positive_int(value: str) -> int:
+	ret = int(value)
+	if ret < 1:
+		raise argparse.ArgumentTypeError(f"must be a positive integer, got {value}")
+	return ret
 
 
 def main():
-	for cache_path in sys.argv[1:]:
+	parser = argparse.ArgumentParser()
+	parser.add_argument("cache_paths", nargs="+", metavar="cache_path")
+	parser.add_argument("--stats", metavar="PATH", help="Write a JSON stats report to PATH (- for stdout)")
+	parser.add_argument("--stats-top", type=int, default=10, help="Number of largest entries to report")
+	parser.add_argument(
+		"--stream", action="store_true",
+		help="Extract while reading the TOC, keeping memory usage flat on huge archives"
+	)
+	parser.add_argument("--window", type=positive_int, default=4096, help="Number of TOC records read at a time with --stream")
+	args = parser.parse_args()
+
+	if args.stats:
+		collector = stats.enable(top=args.stats_top)
+
+	for cache_path in args.cache_paths:
 		assert cache_path.endswith(".cache"), "Filename must end in .cache"
 		toc_path = cache_path.replace(".cache", ".toc")
 		outdir = cache_path.replace(".cache", "/")
 
 		with open(cache_path, "rb") as cache, open(toc_path, "rb") as toc:
-			handle_files(cache, toc, outdir)
+			with stats.timer("cache.handle_files_time", cache_path):
+				if args.stream:
+					handle_files_streaming(cache, toc, outdir, window_size=args.window)
+				else:
+					handle_files(cache, toc, outdir)
+
+	if args.stats:
+		collector.write_report(args.stats)
 
 
 if __name__ == "__main__":
@@ -1,9 +1,15 @@
-from typing import Any, Dict, List
+import json
+import re
+import sys
+from functools import lru_cache
+from json.encoder import encode_basestring_ascii
+from typing import TYPE_CHECKING, Any, Callable, Collection, Dict, Iterator, List, Optional, Tuple
 
-from parsimonious.grammar import Grammar
+if TYPE_CHECKING:
+	from parsimonious.grammar import Grammar
 
 
-GRAMMAR = Grammar(r"""
+GRAMMAR_SOURCE = r"""
 package = NEWL* package_content NEWL*
 
 package_content = (dict_content)?
@@ -37,10 +43,32 @@ BRACE_R = "}"
 COMMA = ","
 EQUALS = "="
 QUOTE = '"'
-""")
+"""
 
 
-def _get_value(node) -> Any:
+@lru_cache(maxsize=None)
+def get_grammar() -> "Grammar":
+	# parsimonious and the grammar compilation are only paid for on first use
+	from parsimonious.grammar import Grammar
+
+	return Grammar(GRAMMAR_SOURCE)
+
+
+def __getattr__(name: str) -> Any:
+	# GRAMMAR used to be compiled at import time
+	if name == "GRAMMAR":
+		return get_grammar()
+	raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def _get_string(text: str, compact: bool) -> str:
+	# In compact mode, paths are interned as they repeat across many packages
+	if compact and text.startswith("/"):
+		return sys.intern(text)
+	return text
+
+
+def _get_value(node, compact: bool = False) -> Any:
 	value_type = node.children[0].expr_name
 
 	if value_type == "FLOAT":
@@ -48,18 +76,18 @@ def _get_value(node) -> Any:
 	elif value_type == "INT":
 		return int(node.text)
 	elif value_type == "RAW_STRING":
-		return node.text
+		return _get_string(node.text, compact)
 	elif value_type == "QUOTED_STRING":
-		return node.children[0].children[1].text
+		return _get_string(node.children[0].children[1].text, compact)
 	elif value_type == "LIST":
-		return _get_list_content(node.children[0].children[1])
+		return _get_list_content(node.children[0].children[1], compact)
 	elif value_type == "DICT":
-		return _get_dict_content(node.children[0].children[2])
+		return _get_dict_content(node.children[0].children[2], compact)
 
 	return None
 
 
-def _get_list_content(node) -> List[Any]:
+def _get_list_content(node, compact: bool = False) -> List[Any]:
 	ret: List[Any] = []
 	if not node.children:
 		return ret
@@ -97,39 +125,274 @@ def _get_list_content(node) -> List[Any]:
 	#         <Node matching "">
 
 	# extract the first item
-	first_item = _get_value(list_content.children[1])
+	first_item = _get_value(list_content.children[1], compact)
 	ret.append(first_item)
 
 	# extract remainder
 	for child in list_content.children[2]:
 		for subchild in child.children:
 			if subchild.expr_name == "value":
-				ret.append(_get_value(subchild))
+				ret.append(_get_value(subchild, compact))
 
 	return ret
 
 
-def _get_dict_content(node) -> Dict[str, Any]:
+def _get_dict_content(node, compact: bool = False) -> Dict[str, Any]:
 	ret = {}
 	for pair in node.children:
 		dict_key = pair.children[0].text
-		value = _get_value(pair.children[2])
+		if compact:
+			dict_key = sys.intern(dict_key)
+		value = _get_value(pair.children[2], compact)
 		ret[dict_key] = value
 
 	return ret
 
 
-def loads(text: str) -> Dict[str, Any]:
-	package = GRAMMAR.parse(text)
-	return _get_dict_content(package.children[1].children[0])
-
-
-if __name__ == "__main__":
-	import json
-	import sys
-
+# Characters that affect nesting while scanning for the end of a top-level pair.
+_SCAN_RE = re.compile(r'["{}\n]')
+_NEWL_RE = re.compile(r" *\n")
+
+
+def _iter_top_level_pairs(text: str) -> Iterator[Tuple[str, int, int]]:
+	"""
+	Yield (key, start, end) for each top-level pair of a package, without
+	parsing the values. Braces are matched outside of quoted strings, and
+	a pair ends on the first newline at depth 0.
+	Raises ValueError if the text does not look like a package.
+	"""
+	# Like the grammar, only allow blank lines before the first pair and after the last
+	pos = _NEWL_RE_MANY.match(text).end()
+	while _NEWL_RE_MANY.match(text, pos).end() != len(text):
+		equals = text.index("=", pos)
+		key = text[pos:equals]
+		if "\n" in key:
+			raise ValueError(f"Invalid key at offset {pos}")
+
+		depth = 0
+		in_quote = False
+		cursor = equals + 1
+		while True:
+			match = _SCAN_RE.search(text, cursor)
+			if not match:
+				raise ValueError(f"Unterminated value for key {key!r}")
+			char = match.group()
+			cursor = match.end()
+			if char == '"':
+				in_quote = not in_quote
+			elif in_quote:
+				continue
+			elif char == "{":
+				depth += 1
+			elif char == "}":
+				depth -= 1
+			elif depth == 0:
+				break
+
+		yield key, pos, cursor
+		pos = cursor
+
+
+def _filter_text(
+	text: str, include: Optional[Collection[str]], exclude: Optional[Collection[str]]
+) -> str:
+	segments = []
+	for key, start, end in _iter_top_level_pairs(text):
+		if include is not None and key not in include:
+			continue
+		if exclude is not None and key in exclude:
+			continue
+		segments.append(text[start:end])
+
+	return "".join(segments)
+
+
+def loads(
+	text: str,
+	include: Optional[Collection[str]] = None,
+	exclude: Optional[Collection[str]] = None,
+	compact: bool = False,
+) -> Dict[str, Any]:
+	"""
+	Parse a package into a dict.
+
+	If `include` is given, only those top-level keys are parsed; keys in
+	`exclude` are always skipped. Skipped values are never run through the
+	grammar, they are only brace-matched to find where they end.
+
+	If `compact` is set, keys and path values are interned so that they
+	are shared between packages.
+	"""
+	if include is not None or exclude is not None:
+		try:
+			filtered_text = _filter_text(text, include, exclude)
+		except ValueError:
+			# Let the grammar report the error properly
+			pass
+		else:
+			if not filtered_text:
+				return {}
+			text = filtered_text
+
+	package = get_grammar().parse(text)
+	return _get_dict_content(package.children[1].children[0], compact)
+
+
+# Token patterns for the transcoder, mirroring the grammar
+_NEWL_RE_MANY = re.compile(r"(?: *\n)*")
+_RAW_STRING_RE = re.compile(r'[^={},\n"]+')
+_QUOTED_STRING_RE = re.compile(r'"([^"]*)"')
+_INT_RE = re.compile(r"-?[0-9]+")
+_FLOAT_RE = re.compile(r"-?[0-9]+\.[0-9]+(?:e[+-][0-9]+)?")
+
+
+class TranscodeError(ValueError):
+	pass
+
+
+def _expect(text: str, pos: int, token: str) -> int:
+	if not text.startswith(token, pos):
+		raise TranscodeError(f"Expected {token!r} at offset {pos}")
+	return pos + len(token)
+
+
+def _is_dict(text: str, pos: int) -> bool:
+	"""
+	Whether the braces at `pos` hold a DICT rather than a LIST.
+	The grammar tries LIST first, but a DICT can only match where a LIST
+	cannot: an empty dict ("{" NEWL "}") or a first item followed by "=".
+	"""
+	start = pos + 1
+	pos = _NEWL_RE_MANY.match(text, start).end()
+	if text.startswith("}", pos):
+		return pos > start
+	match = _RAW_STRING_RE.match(text, pos)
+	return match is not None and text.startswith("=", match.end())
+
+
+def _transcode_value(text: str, pos: int, write: Callable[[str], Any]) -> int:
+	if text.startswith('"', pos):
+		match = _QUOTED_STRING_RE.match(text, pos)
+		if not match:
+			raise TranscodeError(f"Unterminated string at offset {pos}")
+		write(encode_basestring_ascii(match.group(1)))
+		return match.end()
+
+	if text.startswith("{", pos):
+		if _is_dict(text, pos):
+			return _transcode_dict(text, pos, write)
+		return _transcode_list(text, pos, write)
+
+	match = _RAW_STRING_RE.match(text, pos)
+	if not match:
+		raise TranscodeError(f"Expected a value at offset {pos}")
+	token = match.group()
+	# A raw string is only a number if the number spans all of it
+	if _FLOAT_RE.fullmatch(token):
+		write(json.dumps(float(token)))
+	elif _INT_RE.fullmatch(token):
+		write(str(int(token)))
+	else:
+		write(encode_basestring_ascii(token))
+	return match.end()
+
+
+def _transcode_list(text: str, pos: int, write: Callable[[str], Any]) -> int:
+	pos = _expect(text, pos, "{")
+	write("[")
+	if text.startswith("}", pos):
+		write("]")
+		return pos + 1
+
+	pos = _NEWL_RE_MANY.match(text, pos).end()
+	pos = _transcode_value(text, pos, write)
+	while text.startswith(",", pos):
+		pos += 1
+		# A trailing comma may be followed by newlines before the closing brace
+		end = _NEWL_RE_MANY.match(text, pos).end()
+		if text.startswith("}", end):
+			pos = end
+			break
+		newline = _NEWL_RE.match(text, pos)
+		if newline:
+			pos = newline.end()
+		write(", ")
+		pos = _transcode_value(text, pos, write)
+	else:
+		pos = _NEWL_RE_MANY.match(text, pos).end()
+
+	pos = _expect(text, pos, "}")
+	write("]")
+	return pos
+
+
+def _at_dict_end(text: str, pos: int, top_level: bool) -> bool:
+	if top_level:
+		return _NEWL_RE_MANY.match(text, pos).end() == len(text)
+	return text.startswith("}", pos)
+
+
+def _transcode_dict_content(text: str, pos: int, write: Callable[[str], Any], top_level: bool) -> int:
+	write("{")
+	first = True
+	while not _at_dict_end(text, pos, top_level):
+		match = _RAW_STRING_RE.match(text, pos)
+		if not match:
+			raise TranscodeError(f"Expected a key at offset {pos}")
+		if not first:
+			write(", ")
+		first = False
+		write(encode_basestring_ascii(match.group()))
+		write(": ")
+		pos = _expect(text, match.end(), "=")
+		pos = _transcode_value(text, pos, write)
+		newline = _NEWL_RE.match(text, pos)
+		if not newline:
+			raise TranscodeError(f"Expected a newline at offset {pos}")
+		pos = newline.end()
+
+	write("}")
+	return pos
+
+
+def _transcode_dict(text: str, pos: int, write: Callable[[str], Any]) -> int:
+	pos = _expect(text, pos, "{")
+	newline = _NEWL_RE.match(text, pos)
+	if not newline:
+		raise TranscodeError(f"Expected a newline at offset {pos}")
+	pos = _transcode_dict_content(text, newline.end(), write, top_level=False)
+	return _expect(text, pos, "}")
+
+
+def to_json(text: str) -> str:
+	"""
+	Convert a package straight to JSON text, without building Python
+	objects. The result is equivalent to `json.dumps(loads(text))`.
+	Raises TranscodeError if the package is invalid.
+	"""
+	out: List[str] = []
+	transcode(text, out.append)
+	return "".join(out)
+
+
+def transcode(text: str, write: Callable[[str], Any]) -> None:
+	"""
+	Convert a package to JSON, passing the output to `write` (such as
+	`fp.write`) as it is produced. See `to_json()`.
+	Output may already have been written when TranscodeError is raised.
+	"""
+	pos = _NEWL_RE_MANY.match(text).end()
+	_transcode_dict_content(text, pos, write, top_level=True)
+
+
+def main() -> None:
 	for path in sys.argv[1:]:
 		with open(path, "r") as f:
-			decoded = loads(f.read())
+			# Going through the transcoder avoids loading the grammar
+			decoded = json.loads(to_json(f.read()))
 
 		json.dump(decoded, sys.stdout, indent="\t")
+
+
+if __name__ == "__main__":
+	main()
@@ -1,17 +1,83 @@
 #!/usr/bin/env python
+import argparse
 import logging
 import os
+import sys
+from collections import ChainMap
+from collections.abc import Mapping
 from dataclasses import dataclass, field
 from io import BytesIO
-from typing import Any, BinaryIO, Dict, List, Tuple
+from types import MappingProxyType
+from typing import (
+	Any, BinaryIO, Callable, Collection, Dict, FrozenSet, Iterator, List, Optional, Tuple, Union
+)
 
 from binreader import BinaryReader
 
-from .package_parser import loads
+from . import stats
+from .package_parser import loads, to_json, transcode
 
 logger = logging.getLogger(__name__)
 
 
+def _freeze(keys: Optional[Collection[str]]) -> Optional[FrozenSet[str]]:
+	if keys is None:
+		return None
+	return frozenset(keys)
+
+
+def _make_read_only(value: Any) -> Any:
+	if isinstance(value, dict):
+		return MappingProxyType({k: _make_read_only(v) for k, v in value.items()})
+	elif isinstance(value, list):
+		return tuple(_make_read_only(v) for v in value)
+	return value
+
+
+class LayeredContent(Mapping):
+	"""
+	Read-only resolved content of a package in compact mode, layered over
+	its parents' content. The layers are shared with other packages, so
+	nested dicts are read-only mappings and nested lists are tuples.
+	"""
+
+	def __init__(self, layers: ChainMap) -> None:
+		self._layers = layers
+
+	def __getitem__(self, key: str) -> Any:
+		return self._layers[key]
+
+	def __iter__(self) -> Iterator[str]:
+		return iter(self._layers)
+
+	def __len__(self) -> int:
+		return len(self._layers)
+
+	def __repr__(self) -> str:
+		return f"{self.__class__.__name__}({self.to_dict()!r})"
+
+	def to_dict(self) -> Dict[str, Any]:
+		"""
+		A plain dict of the top-level keys. Nested values are still shared
+		and read-only.
+		"""
+		return {key: self[key] for key in self}
+
+
+def json_default(obj: Any) -> Any:
+	"""
+	`default` for json.dump() that serializes compact mode content.
+	"""
+	if isinstance(obj, LayeredContent):
+		return obj.to_dict()
+	if isinstance(obj, MappingProxyType):
+		return dict(obj)
+	raise TypeError(f"Object of type {obj.__class__.__name__} is not JSON serializable")
+
+
+Content = Union[Dict[str, Any], LayeredContent]
+
+
 @dataclass
 class Package:
 	path: str
@@ -20,24 +86,113 @@ class Package:
 
 	@property
 	def content(self) -> Dict[str, Any]:
-		return loads(self.data.decode())
+		return self.get_content()
+
+	def get_content(
+		self,
+		include: Optional[Collection[str]] = None,
+		exclude: Optional[Collection[str]] = None,
+		compact: bool = False,
+	) -> Dict[str, Any]:
+		stats.incr("packages.parsed")
+		with stats.timer("packages.parse_time", self.path):
+			return loads(self.data.decode(), include=include, exclude=exclude, compact=compact)
+
+	@property
+	def json_content(self) -> str:
+		"""
+		The package's own content as JSON text, without building Python objects.
+		"""
+		stats.incr("packages.transcoded")
+		with stats.timer("packages.transcode_time", self.path):
+			return to_json(self.data.decode())
+
+	def write_json(self, write: Callable[[str], Any]) -> None:
+		"""
+		Write the package's own content as JSON text through `write()`, as
+		it is produced. Output may already have been written when
+		TranscodeError is raised.
+		"""
+		stats.incr("packages.transcoded")
+		with stats.timer("packages.transcode_time", self.path):
+			transcode(self.data.decode(), write)
+
+	def get_full_content(
+		self,
+		packages_file: "PackagesFile",
+		include: Optional[Collection[str]] = None,
+		exclude: Optional[Collection[str]] = None,
+	) -> Content:
+		stats.incr("packages.resolved")
+		with stats.timer("packages.resolve_time", self.path):
+			if packages_file.compact:
+				return LayeredContent(self._get_layered_content(packages_file, include, exclude))
+			return self._get_merged_content(packages_file, include, exclude)
 
-	def get_full_content(self, packages_file: "PackagesFile") -> dict:
+	def _get_merged_content(
+		self,
+		packages_file: "PackagesFile",
+		include: Optional[Collection[str]],
+		exclude: Optional[Collection[str]],
+	) -> Dict[str, Any]:
 		if not self.parent_path:
-			return self.content
+			return self.get_content(include, exclude)
 
 		if self.parent_path not in packages_file._packages:
 			content = {}
 		else:
 			parent_package = packages_file._packages[self.parent_path]
-			content = parent_package.get_full_content(packages_file)
-		content.update(self.content)
+			content = parent_package._get_merged_content(packages_file, include, exclude)
+		content.update(self.get_content(include, exclude))
 		return content
 
+	def _get_layered_content(
+		self,
+		packages_file: "PackagesFile",
+		include: Optional[Collection[str]],
+		exclude: Optional[Collection[str]],
+	) -> ChainMap:
+		cache_key = (self.path, _freeze(include), _freeze(exclude))
+		layers = packages_file._content_cache.get(cache_key)
+		if layers is not None:
+			stats.incr("packages.cache_hits")
+			return layers
+
+		stats.incr("packages.cache_misses")
+		content = {
+			key: _make_read_only(value)
+			for key, value in self.get_content(include, exclude, compact=True).items()
+		}
+		parent_package = packages_file._packages.get(self.parent_path)
+		if parent_package is not None:
+			parent_layers = parent_package._get_layered_content(packages_file, include, exclude)
+			layers = ChainMap(content, *parent_layers.maps)
+		else:
+			layers = ChainMap(content)
+
+		packages_file._content_cache[cache_key] = layers
+		return layers
+
 
 class PackagesFile:
-	def __init__(self, bin_file: BinaryIO) -> None:
+	"""
+	If `compact` is set, parsed packages are cached with their keys and paths
+	interned, and resolved content is a read-only LayeredContent over the
+	parents' content instead of a copy of it.
+
+	Unlike the default mode, compact content cannot be modified: nested
+	dicts are read-only mappings, nested lists are tuples, and assigning
+	to either raises TypeError. Serialize it with `json_default`.
+	"""
+
+	def __init__(self, bin_file: BinaryIO, compact: bool = False) -> None:
+		self.compact = compact
 		self._packages: Dict[str, Package] = {}
+		self._content_cache: Dict[Tuple, ChainMap] = {}
+		with stats.timer("packages.read_time"):
+			self._read(bin_file, compact)
+
+	def _read(self, bin_file: BinaryIO, compact: bool) -> None:
 		reader = BinaryReader(bin_file)
 		self.hash = reader.read(29)
 
@@ -70,12 +225,67 @@ class PackagesFile:
 			path = os.path.join(base_path, name)
 			if parent_path:
 				parent_path = os.path.join(base_path, parent_path)
+			if compact:
+				path = sys.intern(path)
+				parent_path = sys.intern(parent_path)
 
 			self._packages[path] = Package(path, parent_path, chunk)
+			stats.incr("packages.count")
+			stats.incr("packages.bytes", len(chunk))
 
-	def __getitem__(self, key: str) -> Dict[str, Any]:
+	def __getitem__(self, key: str) -> Content:
 		return self._packages[key].get_full_content(self)
 
 	@property
 	def packages(self):
 		return list(self._packages.values())
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser()
+	parser.add_argument("bin_paths", nargs="+", metavar="bin_path")
+	parser.add_argument("--stats", metavar="PATH", help="Write a JSON stats report to PATH (- for stdout)")
+	parser.add_argument("--stats-top", type=int, default=10, help="Number of slowest packages to report")
+	args = parser.parse_args()
+
+	logging.basicConfig(level=logging.DEBUG)
+
+	if args.stats:
+		collector = stats.enable(top=args.stats_top)
+
+	for bin_path in args.bin_paths:
+		with open(bin_path, "rb") as bin_file:
+			packages = PackagesFile(bin_file)
+
+		outdir, _ = os.path.splitext(bin_path)
+
+		def get_local_path(path: str) -> str:
+			return os.path.join(outdir, path.lstrip("/"))
+
+		for package in packages.packages:
+			dirname = get_local_path(os.path.dirname(package.path))
+			if not os.path.exists(dirname):
+				os.makedirs(dirname)
+
+			local_path = get_local_path(package.path)
+			logger.info(f"Extracting {local_path}")
+
+			# Written as it is transcoded, and only renamed once complete
+			tmp_path = f"{local_path}.json.tmp"
+			try:
+				with open(tmp_path, "w") as fp:
+					package.write_json(fp.write)
+			except Exception:
+				logger.exception(f"Could not decode data for {package.path!r}")
+				os.remove(tmp_path)
+				with open(f"{local_path}.wfpkg", "wb") as f:
+					f.write(package.data)
+			else:
+				os.replace(tmp_path, f"{local_path}.json")
+
+	if args.stats:
+		collector.write_report(args.stats)
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,185 @@
+"""
+Lightweight instrumentation for the extraction tools.
+
+Collection is disabled by default: every hook returns immediately until
+`enable()` is called, and `timer()` hands out a shared no-op context manager.
+"""
+import heapq
+import json
+import sys
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Any, Callable, ContextManager, Dict, List, Optional, TextIO, Tuple
+
+
+Callback = Callable[[str, str, float], None]
+
+_NULL_TIMER = nullcontext()
+
+
+class Collector:
+	def __init__(self, top: int = 10) -> None:
+		self.top = top
+		self.started = time.perf_counter()
+		self.counters: Dict[str, float] = {}
+		# name -> [count, total, max]
+		self.observations: Dict[str, List[float]] = {}
+		# name -> min-heap of the `top` largest (value, label), one per label
+		self.largest: Dict[str, List[Tuple[float, str]]] = {}
+		# name -> {label: value} of the labels in the heap
+		self._largest_labels: Dict[str, Dict[str, float]] = {}
+		self.callbacks: List[Callback] = []
+
+	def add_callback(self, callback: Callback) -> None:
+		"""
+		Register `callback(name, label, value)`, called for every counter
+		increment and observation.
+		"""
+		self.callbacks.append(callback)
+
+	def incr(self, name: str, value: float = 1) -> None:
+		self.counters[name] = self.counters.get(name, 0) + value
+		for callback in self.callbacks:
+			callback(name, "", value)
+
+	def observe(self, name: str, label: str, value: float) -> None:
+		observation = self.observations.get(name)
+		if observation is None:
+			self.observations[name] = [1, value, value]
+		else:
+			observation[0] += 1
+			observation[1] += value
+			observation[2] = max(observation[2], value)
+
+		if label and self.top:
+			self._add_largest(name, label, value)
+
+		for callback in self.callbacks:
+			callback(name, label, value)
+
+	def _add_largest(self, name: str, label: str, value: float) -> None:
+		heap = self.largest.setdefault(name, [])
+		labels = self._largest_labels.setdefault(name, {})
+		if label in labels:
+			# Only keep the largest value of each label
+			if value > labels[label]:
+				labels[label] = value
+				heap[:] = [(value if l == label else v, l) for v, l in heap]
+				heapq.heapify(heap)
+		elif len(heap) < self.top:
+			heapq.heappush(heap, (value, label))
+			labels[label] = value
+		elif value > heap[0][0]:
+			_, evicted = heapq.heapreplace(heap, (value, label))
+			del labels[evicted]
+			labels[label] = value
+
+	def merge(self, other: "Collector") -> None:
+		"""
+		Add the data of `other`, such as a collector filled in a worker
+		process. Callbacks are not called for the merged data.
+		"""
+		for name, value in other.counters.items():
+			self.counters[name] = self.counters.get(name, 0) + value
+
+		for name, (count, total, max_value) in other.observations.items():
+			observation = self.observations.get(name)
+			if observation is None:
+				self.observations[name] = [count, total, max_value]
+			else:
+				observation[0] += count
+				observation[1] += total
+				observation[2] = max(observation[2], max_value)
+
+		if self.top:
+			for name, heap in other.largest.items():
+				for value, label in heap:
+					self._add_largest(name, label, value)
+
+	def __getstate__(self) -> Dict[str, Any]:
+		# Callbacks are not sent across processes
+		state = self.__dict__.copy()
+		state["callbacks"] = []
+		return state
+
+	@contextmanager
+	def timer(self, name: str, label: str = ""):
+		start = time.perf_counter()
+		try:
+			yield
+		finally:
+			self.observe(name, label, time.perf_counter() - start)
+
+	def report(self) -> Dict[str, Any]:
+		elapsed = time.perf_counter() - self.started
+		counters = self.counters
+		derived: Dict[str, float] = {}
+
+		bytes_read = counters.get("cache.bytes_read", 0)
+		if bytes_read:
+			derived["cache.compression_ratio"] = counters.get("cache.bytes_written", 0) / bytes_read
+		for name in ("cache.entries", "packages.parsed", "packages.resolved", "packages.transcoded"):
+			if counters.get(name) and elapsed:
+				derived[f"{name}_per_second"] = counters[name] / elapsed
+
+		return {
+			"elapsed": elapsed,
+			"counters": dict(sorted(counters.items())),
+			"derived": derived,
+			"observations": {
+				name: {"count": count, "total": total, "mean": total / count, "max": max_value}
+				for name, (count, total, max_value) in sorted(self.observations.items())
+			},
+			"largest": {
+				name: [{"label": label, "value": value} for value, label in sorted(heap, reverse=True)]
+				for name, heap in sorted(self.largest.items())
+			},
+		}
+
+	def write_report(self, path: str) -> None:
+		"""
+		Write the report as JSON to `path`, or to stdout if `path` is "-".
+		"""
+		if path == "-":
+			self._dump_report(sys.stdout)
+		else:
+			with open(path, "w") as f:
+				self._dump_report(f)
+
+	def _dump_report(self, fp: TextIO) -> None:
+		json.dump(self.report(), fp, indent="\t")
+		fp.write("\n")
+
+
+_collector: Optional[Collector] = None
+
+
+def enable(top: int = 10) -> Collector:
+	global _collector
+	_collector = Collector(top=top)
+	return _collector
+
+
+def disable() -> None:
+	global _collector
+	_collector = None
+
+
+def get_collector() -> Optional[Collector]:
+	return _collector
+
+
+def incr(name: str, value: float = 1) -> None:
+	if _collector is not None:
+		_collector.incr(name, value)
+
+
+def observe(name: str, label: str, value: float) -> None:
+	if _collector is not None:
+		_collector.observe(name, label, value)
+
+
+def timer(name: str, label: str = "") -> ContextManager:
+	if _collector is None:
+		return _NULL_TIMER
+	return _collector.timer(name, label)
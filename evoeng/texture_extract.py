@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+import argparse
+import json
+import multiprocessing
+import os
+import posixpath
+from typing import Any, BinaryIO, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from . import stats
+from .cache_extract import (
+	FILE_SUFFIX, DirectoryTable, TOCEntry, get_file_time, get_local_path,
+	iter_toc_records, read_entry_data, read_toc_header
+)
+from .package_parser import loads
+
+
+TEXTURE_EXTENSIONS = {".dds", ".jpg", ".png", ".tga"}
+
+# Number of entries extracted by each worker task
+BATCH_SIZE = 64
+
+
+def normalize_reference(reference: str) -> str:
+	# Manifest texture locations may use backslashes and carry a "!hash" suffix
+	return reference.replace("\\", "/").split("!", 1)[0]
+
+
+def get_manifest_references(manifest: dict) -> Set[str]:
+	return {
+		normalize_reference(item["textureLocation"])
+		for item in manifest.get("Manifest", []) if item.get("textureLocation")
+	}
+
+
+def get_icon_references(collection: dict) -> Set[str]:
+	return {
+		normalize_reference(platform["Material"])
+		for icon in collection.get("Icons", [])
+		for platform in icon.get("Platforms", []) if platform.get("Material")
+	}
+
+
+def _iter_strings(value: Any) -> Iterator[str]:
+	if isinstance(value, str):
+		yield value
+	elif isinstance(value, dict):
+		for item in value.values():
+			yield from _iter_strings(item)
+	elif isinstance(value, list):
+		for item in value:
+			yield from _iter_strings(item)
+
+
+def get_material_references(material_path: str, reference: str) -> Set[str]:
+	"""
+	Return the textures used by the extracted material at `material_path`.
+	Relative texture paths are resolved against the material's directory.
+	"""
+	with open(material_path, "rb") as f:
+		data = f.read()
+
+	try:
+		content = loads(data.decode())
+	except Exception as e:
+		print(f"Cannot parse material {reference} ({e.__class__.__name__})")
+		return set()
+
+	ret = set()
+	for value in _iter_strings(content):
+		path = normalize_reference(value)
+		if posixpath.splitext(path)[1].lower() not in TEXTURE_EXTENSIONS:
+			continue
+		if not path.startswith("/"):
+			path = posixpath.normpath(posixpath.join(posixpath.dirname(reference), path))
+		ret.add(path)
+
+	return ret
+
+
+def find_entries(toc: BinaryIO, references: Set[str], window_size: int = 4096) -> List[TOCEntry]:
+	"""
+	Return the TOC entries of the files whose path is in `references`.
+	When a path is listed more than once, only its newest entry is kept.
+	The TOC is streamed, only the directory table and the matches are kept.
+	"""
+	read_toc_header(toc)
+
+	directories = DirectoryTable()
+	entries: Dict[str, TOCEntry] = {}
+	last_parent, last_path = -1, ""
+	for record in iter_toc_records(toc, window_size):
+		offset, timestamp, compressed_size, size, scope_index, parent, filename = record
+		if offset == -1:
+			directories.add(parent, filename.rstrip(b"\0"))
+			continue
+
+		if parent != last_parent:
+			last_parent, last_path = parent, directories.get_path(parent)
+		filename = filename.rstrip(b"\0").decode()
+		full_path = f"{last_path.rstrip('/')}/{filename}"
+		if full_path not in references:
+			continue
+
+		entry = TOCEntry(
+			offset, get_file_time(timestamp), compressed_size, size, scope_index,
+			last_path, filename
+		)
+		previous = entries.get(full_path)
+		if previous is None or (entry.time and (not previous.time or entry.time >= previous.time)):
+			entries[full_path] = entry
+
+	return list(entries.values())
+
+
+def is_up_to_date(local_path: str, entry: TOCEntry) -> bool:
+	# Extracted files get the entry's time as their mtime
+	return os.path.isfile(local_path) and os.path.getmtime(local_path) == entry.time.timestamp()
+
+
+def _extract_batch(
+	task: Tuple[str, List[Tuple[TOCEntry, str]], Optional[int]]
+) -> Tuple[List[str], Optional[stats.Collector]]:
+	cache_path, entries, stats_top = task
+	# In a worker, stats are collected per task and merged back by the parent
+	collector = None
+	if stats_top is not None:
+		collector = stats.enable(top=stats_top)
+
+	extracted = []
+	with open(cache_path, "rb") as cache:
+		for entry, local_path in entries:
+			data = read_entry_data(cache, entry)
+			os.makedirs(os.path.dirname(local_path), exist_ok=True)
+			with open(local_path, "wb") as f:
+				f.write(data)
+
+			ts = entry.time.timestamp()
+			os.utime(local_path, (ts, ts))
+			extracted.append(local_path)
+
+	return extracted, collector
+
+
+def extract_references(
+	cache_paths: Iterable[str], references: Set[str], outdir: str, jobs: int = 1
+) -> Dict[str, str]:
+	"""
+	Extract the entries of `references` found in the given caches into
+	`outdir`, skipping the ones whose TOC time matches the file already
+	there. Returns the local path of each reference that was found.
+	"""
+	found: Dict[str, str] = {}
+	tasks = []
+	for cache_path in cache_paths:
+		assert cache_path.endswith(".cache"), "Filename must end in .cache"
+		toc_path = cache_path.replace(".cache", ".toc")
+		with open(toc_path, "rb") as toc:
+			entries = find_entries(toc, references - found.keys())
+
+		pending = []
+		for entry in entries:
+			if not entry.time:
+				print("Skipping entry without time", repr(entry))
+				continue
+
+			local_path = get_local_path(outdir, entry.full_path)
+			if os.path.isdir(local_path):
+				local_path += FILE_SUFFIX
+			found[entry.full_path] = local_path
+			if is_up_to_date(local_path, entry):
+				stats.incr("textures.up_to_date")
+				continue
+			pending.append((entry, local_path))
+
+		# Read each cache sequentially, in batches
+		pending.sort(key=lambda item: item[0].offset)
+		for i in range(0, len(pending), BATCH_SIZE):
+			tasks.append((cache_path, pending[i:i + BATCH_SIZE]))
+
+	print(f"Extracting {sum(len(entries) for _, entries in tasks)} entries")
+	if jobs > 1 and len(tasks) > 1:
+		collector = stats.get_collector()
+		stats_top = collector.top if collector is not None else None
+		with multiprocessing.Pool(jobs) as pool:
+			results = list(pool.imap_unordered(
+				_extract_batch, [(cache_path, entries, stats_top) for cache_path, entries in tasks]
+			))
+	else:
+		results = [_extract_batch((cache_path, entries, None)) for cache_path, entries in tasks]
+
+	for extracted, worker_collector in results:
+		stats.incr("textures.extracted", len(extracted))
+		if worker_collector is not None:
+			stats.get_collector().merge(worker_collector)
+
+	return found
+
+
+def extract_textures(
+	cache_paths: Iterable[str], references: Set[str], outdir: str, jobs: int = 1
+) -> Set[str]:
+	"""
+	Extract `references` like extract_references(), then the textures used
+	by the materials among them. Returns the references that could not be
+	found.
+	"""
+	cache_paths = list(cache_paths)
+	found = extract_references(cache_paths, references, outdir, jobs=jobs)
+
+	textures: Set[str] = set()
+	for reference, local_path in found.items():
+		if reference.endswith(".material"):
+			textures |= get_material_references(local_path, reference)
+	textures -= found.keys()
+
+	if textures:
+		print(f"Extracting {len(textures)} textures used by materials")
+		found.update(extract_references(cache_paths, textures, outdir, jobs=jobs))
+
+	missing = (references | textures) - found.keys()
+	stats.incr("textures.missing", len(missing))
+	return missing
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser(
+		description="Extract the textures referenced by the export manifest and platform icons"
+	)
+	parser.add_argument("cache_paths", nargs="+", metavar="cache_path")
+	parser.add_argument("--manifest", metavar="PATH", help="Locally cached ExportManifest.json")
+	parser.add_argument(
+		"--icons", metavar="PATH", help="LotusPlatformIconCollection package, as JSON"
+	)
+	parser.add_argument("-o", "--outdir", default="textures", help="Output directory (default: %(default)s)")
+	parser.add_argument(
+		"-j", "--jobs", type=int, default=os.cpu_count() or 1,
+		help="Number of processes used to extract entries (default: %(default)s)"
+	)
+	parser.add_argument("--stats", metavar="PATH", help="Write a JSON stats report to PATH (- for stdout)")
+	parser.add_argument("--stats-top", type=int, default=10, help="Number of largest entries to report")
+	args = parser.parse_args()
+
+	if not args.manifest and not args.icons:
+		parser.error("At least one of --manifest and --icons is required")
+
+	if args.stats:
+		collector = stats.enable(top=args.stats_top)
+
+	references: Set[str] = set()
+	if args.manifest:
+		with open(args.manifest, "r") as f:
+			references |= get_manifest_references(json.load(f))
+	if args.icons:
+		with open(args.icons, "r") as f:
+			references |= get_icon_references(json.load(f))
+
+	missing = extract_textures(args.cache_paths, references, args.outdir, jobs=args.jobs)
+	for reference in sorted(missing):
+		print(f"Cannot find {reference}")
+
+	if args.stats:
+		collector.write_report(args.stats)
+
+
+if __name__ == "__main__":
+	main()
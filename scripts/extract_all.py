@@ -1,19 +1,30 @@
 #!/usr/bin/env python
+import argparse
+import hashlib
 import json
 import logging
+import multiprocessing
 import os
 import posixpath
-import sys
-from typing import Dict, List, Set
-
-import requests
+import sqlite3
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
 
+from evoeng import stats
 from evoeng.packages_extract import PackagesFile
 
 logger = logging.getLogger(__name__)
 
 
 MANIFEST_URL = "http://content.warframe.com/MobileExport/Manifest/ExportManifest.json"
+CODEX_MANIFEST = "/Lotus/Types/Lore/PrimaryCodexManifest"
+MOD_TAGS = ["Mod", "RelicsAndArcanes"]
+ITEM_TAGS = ["Sentinel", "SentinelWeapon", "Warframe", "Weapon"]
+IDS_PATH = "ids.json"
+DATA_PATH = "data.json"
+
+# Stay below SQLITE_MAX_VARIABLE_NUMBER on older sqlite builds
+SQLITE_CHUNK_SIZE = 500
 
 TOP_LEVEL_KEYS_BLACKLIST = {
 	"AimStartSound",
@@ -72,9 +83,29 @@ TOP_LEVEL_KEYS_BLACKLIST = {
 }
 
 
-def get_texture_manifest() -> dict:
-	print(f"Downloading {MANIFEST_URL}")
-	manifest = requests.get(MANIFEST_URL).json().get("Manifest", [])
+def get_texture_manifest(path: str = "", refresh: bool = False) -> dict:
+	if path and os.path.exists(path) and not refresh:
+		print(f"Loading {path}")
+		with open(path, "r") as f:
+			manifest = json.load(f).get("Manifest", [])
+	else:
+		import requests
+
+		print(f"Downloading {MANIFEST_URL}")
+		response = requests.get(MANIFEST_URL)
+		response.raise_for_status()
+		data = response.json()
+		if not isinstance(data, dict) or "Manifest" not in data:
+			raise RuntimeError(f"Unexpected manifest from {MANIFEST_URL}")
+
+		if path:
+			# Keep a copy for the next runs (and for evoeng-texture-extract)
+			tmp_path = f"{path}.tmp"
+			with open(tmp_path, "wb") as f:
+				f.write(response.content)
+			os.replace(tmp_path, path)
+		manifest = data["Manifest"]
+
 	return {o["uniqueName"]: o["textureLocation"].replace("\\", "/") for o in manifest}
 
 
@@ -90,43 +121,232 @@ def get_top_level_parent(package, packages):
 	return package
 
 
-class Extractor:
-	def __init__(self, args):
-		bin_path = args[0]
+# Inherited by the pool workers when they fork, so it is never pickled
+_worker_packages: Optional[PackagesFile] = None
+
+
+def _parse_package(key: str) -> Tuple[str, dict, Optional[stats.Collector]]:
+	# Stats are collected per task and merged back by the parent process
+	collector = stats.get_collector()
+	if collector is not None:
+		collector = stats.enable(top=collector.top)
+
+	pkgobj = _worker_packages._packages[key]
+	content = pkgobj.get_full_content(_worker_packages, exclude=TOP_LEVEL_KEYS_BLACKLIST)
+	return key, content, collector
+
+
+@contextmanager
+def sqlite_transaction(connection: sqlite3.Connection) -> Iterator[sqlite3.Connection]:
+	# Take the write lock up front so concurrent jobs serialize their allocations
+	connection.execute("BEGIN IMMEDIATE")
+	try:
+		yield connection
+	except BaseException:
+		connection.execute("ROLLBACK")
+		raise
+	else:
+		connection.execute("COMMIT")
+
+
+def content_hash(value: Any) -> str:
+	serialized = json.dumps(value, sort_keys=True, ensure_ascii=False)
+	return hashlib.sha1(serialized.encode()).hexdigest()
+
+
+class JSONIdRegistry:
+	def __init__(self, path: str) -> None:
+		if not os.path.exists(path):
+			raise RuntimeError(f"Cannot find `{path}`.")
+
+		self.path = path
+		self._ids: Optional[Dict[str, int]] = None
+		self.max_id = 0
+
+	@property
+	def ids(self) -> Dict[str, int]:
+		# Only loaded once an id is actually needed
+		if self._ids is None:
+			with open(self.path, "r") as f:
+				self._ids = json.load(f)
+			if self._ids:
+				self.max_id = max(self._ids.values())
+		return self._ids
+
+	def allocate(self, keys: Iterable[str]) -> Dict[str, int]:
+		ret = {}
+		for key in keys:
+			assert key, "Key should never be an empty string"
+			if key not in self.ids:
+				self.max_id += 1
+				self.ids[key] = self.max_id
+				print(f"New id: {self.max_id} - {key}")
+			ret[key] = self.ids[key]
 
-		if not os.path.exists("ids.json"):
-			raise RuntimeError("Cannot find `ids.json`.")
+		return ret
+
+	def save(self) -> None:
+		if self._ids is None:
+			return
+		with open(self.path, "w") as f:
+			json.dump(self._ids, f, indent="\t", sort_keys=True)
+
+
+class SQLiteIdRegistry:
+	def __init__(self, connection: sqlite3.Connection, seed_path: str = "") -> None:
+		self.connection = connection
+		# Ids never change once assigned, so they can be cached locally
+		self.ids: Dict[str, int] = {}
+
+		with sqlite_transaction(connection):
+			connection.execute(
+				"CREATE TABLE IF NOT EXISTS ids (path TEXT PRIMARY KEY, id INTEGER NOT NULL UNIQUE)"
+			)
+			is_empty = connection.execute("SELECT 1 FROM ids LIMIT 1").fetchone() is None
+			if is_empty and seed_path and os.path.exists(seed_path):
+				print(f"Importing ids from {seed_path}")
+				with open(seed_path, "r") as f:
+					connection.executemany(
+						"INSERT INTO ids (path, id) VALUES (?, ?)", json.load(f).items()
+					)
+
+	def allocate(self, keys: Iterable[str]) -> Dict[str, int]:
+		keys = list(dict.fromkeys(keys))
+		for key in keys:
+			assert key, "Key should never be an empty string"
+
+		missing = [key for key in keys if key not in self.ids]
+		if missing:
+			with sqlite_transaction(self.connection):
+				for i in range(0, len(missing), SQLITE_CHUNK_SIZE):
+					chunk = missing[i:i + SQLITE_CHUNK_SIZE]
+					placeholders = ",".join("?" * len(chunk))
+					self.ids.update(self.connection.execute(
+						f"SELECT path, id FROM ids WHERE path IN ({placeholders})", chunk
+					))
+
+				max_id, = self.connection.execute("SELECT COALESCE(MAX(id), 0) FROM ids").fetchone()
+				new_ids = []
+				for key in missing:
+					if key not in self.ids:
+						max_id += 1
+						self.ids[key] = max_id
+						new_ids.append((key, max_id))
+						print(f"New id: {max_id} - {key}")
+
+				self.connection.executemany("INSERT INTO ids (path, id) VALUES (?, ?)", new_ids)
+
+		return {key: self.ids[key] for key in keys}
+
+	def save(self) -> None:
+		# Every allocation is committed as it happens
+		pass
+
+
+class JSONOutputStore:
+	def __init__(self, path: str) -> None:
+		self.path = path
+
+	def save(self, data: dict) -> None:
+		with open(self.path, "w") as f:
+			json.dump(data, f, indent="\t", sort_keys=True, ensure_ascii=False)
+
+
+class SQLiteOutputStore:
+	"""
+	Stores every extracted entry as a row of its section (Mods, Items,
+	ModSets) along with a content hash, and the parent of each entry.
+	Saving only writes the rows that changed since the last run.
+	"""
+
+	def __init__(self, connection: sqlite3.Connection) -> None:
+		self.connection = connection
+		with sqlite_transaction(connection):
+			connection.execute("""
+				CREATE TABLE IF NOT EXISTS entries (
+					section TEXT NOT NULL,
+					path TEXT NOT NULL,
+					content TEXT NOT NULL,
+					hash TEXT NOT NULL,
+					PRIMARY KEY (section, path)
+				)
+			""")
+			connection.execute(
+				"CREATE TABLE IF NOT EXISTS parents (path TEXT PRIMARY KEY, parent TEXT NOT NULL)"
+			)
+
+	def save(self, data: dict) -> None:
+		parents: Dict[str, str] = {}
+		with sqlite_transaction(self.connection):
+			for section, entries in data.items():
+				existing = dict(self.connection.execute(
+					"SELECT path, hash FROM entries WHERE section = ?", (section, )
+				))
+
+				changed = []
+				for path, entry in entries.items():
+					entry_hash = content_hash(entry)
+					if existing.pop(path, None) != entry_hash:
+						content = json.dumps(entry, sort_keys=True, ensure_ascii=False)
+						changed.append((section, path, content, entry_hash))
+					if isinstance(entry, dict) and entry.get("parent"):
+						parents[path] = entry["parent"]
+
+				self.connection.executemany("""
+					INSERT INTO entries (section, path, content, hash) VALUES (?, ?, ?, ?)
+					ON CONFLICT (section, path) DO UPDATE SET content = excluded.content, hash = excluded.hash
+				""", changed)
+				self.connection.executemany(
+					"DELETE FROM entries WHERE section = ? AND path = ?",
+					[(section, path) for path in existing]
+				)
+				print(f"{section}: {len(changed)} rows written, {len(existing)} rows deleted")
+
+			existing_parents = dict(self.connection.execute("SELECT path, parent FROM parents"))
+			self.connection.executemany("""
+				INSERT INTO parents (path, parent) VALUES (?, ?)
+				ON CONFLICT (path) DO UPDATE SET parent = excluded.parent
+			""", [
+				(path, parent) for path, parent in parents.items()
+				if existing_parents.get(path) != parent
+			])
+			self.connection.executemany(
+				"DELETE FROM parents WHERE path = ?",
+				[(path, ) for path in existing_parents if path not in parents]
+			)
 
-		with open("ids.json", "r") as f:
-			self.ids = json.load(f)
 
-		if self.ids:
-			self.max_id = max(self.ids.values())
+class Extractor:
+	def __init__(self, args: argparse.Namespace) -> None:
+		bin_path = args.bin_path
+
+		if args.sqlite:
+			connection = sqlite3.connect(args.sqlite, isolation_level=None, timeout=60)
+			self.ids = SQLiteIdRegistry(connection, seed_path=IDS_PATH)
+			self.output = SQLiteOutputStore(connection)
 		else:
-			self.max_id = 0
+			self.ids = JSONIdRegistry(IDS_PATH)
+			self.output = JSONOutputStore(DATA_PATH)
 
-		self.texture_manifest = get_texture_manifest()
+		self.texture_manifest = get_texture_manifest(args.manifest, refresh=args.refresh_manifest)
 		self.all_keys: Set[str] = set()
 		self.orphans: Set[str] = set()
 		self.exalted_items: Set[str] = set()
 		self.mod_sets: Set[str] = set()
+		self.jobs: int = args.jobs
+		self._parse_cache: Dict[str, dict] = {}
 
 		with open(bin_path, "rb") as bin_file:
 			print(f"Parsing {bin_path}")
 			self.packages = PackagesFile(bin_file)
 
 	def get_or_save_id(self, key: str) -> int:
-		assert key, "Key should never be an empty string"
-		if key in self.ids:
-			return self.ids[key]
-		else:
-			self.max_id += 1
-			self.ids[key] = self.max_id
-			print(f"New id: {self.max_id} - {key}")
-			return self.max_id
+		return self.ids.allocate([key])[key]
 
 	def process_orphans(self, ret):
 		while self.orphans:
+			stats.incr("extract.orphan_passes")
+			stats.incr("extract.orphans", len(self.orphans))
 			for key in list(self.orphans):
 				try:
 					pkgobj = self.packages._packages[key]
@@ -145,7 +365,7 @@ class Extractor:
 		ret = {
 			"path": key,
 			"id": self.get_or_save_id(key),
-			"data": pkgobj.get_full_content(self.packages),
+			"data": self.get_content(key, pkgobj),
 		}
 
 		manifest_key = self.texture_manifest.get(key, "")
@@ -171,6 +391,42 @@ class Extractor:
 
 		return ret
 
+	def get_content(self, key: str, pkgobj) -> dict:
+		# Prefetched content is handed out once, the caller owns (and modifies) it
+		if key in self._parse_cache:
+			stats.incr("extract.parse_cache_hits")
+			return self._parse_cache.pop(key)
+		stats.incr("extract.parse_cache_misses")
+		return pkgobj.get_full_content(self.packages, exclude=TOP_LEVEL_KEYS_BLACKLIST)
+
+	def prefetch(self, keys: Iterable[str]) -> None:
+		"""
+		Parse the given packages across a process pool ahead of time.
+		Only parsing is done in the workers: ids and the extraction state
+		are still handled serially, so the results do not depend on `jobs`.
+		"""
+		global _worker_packages
+
+		keys = sorted({key for key in keys if key in self.packages._packages} - self._parse_cache.keys())
+		if self.jobs <= 1 or not keys or "fork" not in multiprocessing.get_all_start_methods():
+			return
+
+		print(f"Parsing {len(keys)} packages with {self.jobs} jobs…")
+		_worker_packages = self.packages
+		try:
+			with multiprocessing.get_context("fork").Pool(self.jobs) as pool:
+				chunksize = max(1, len(keys) // (self.jobs * 8))
+				for key, content, worker_collector in pool.imap_unordered(_parse_package, keys, chunksize):
+					self._parse_cache[key] = content
+					if worker_collector is not None:
+						stats.get_collector().merge(worker_collector)
+		finally:
+			_worker_packages = None
+
+	def get_codex_entries(self) -> List[dict]:
+		manifest = self.packages[CODEX_MANIFEST]
+		return manifest.get("Entries", []) + manifest.get("AutoGeneratedEntries", [])
+
 	def _clean_keys(self, d, key):
 		# Resolve behaviors packages
 		data = d[key]["data"]
@@ -185,11 +441,6 @@ class Extractor:
 						else:
 							v[path_key] = {}
 
-		# Clean keys we know we don't want
-		for blacklisted_key in TOP_LEVEL_KEYS_BLACKLIST:
-			if blacklisted_key in data:
-				del data[blacklisted_key]
-
 		# LocTags can sometimes be "Lotus/Language/Foo/..."
 		# These appear to always be relative to the root (/)
 		# so we can safely do "/" + LocTag
@@ -219,11 +470,15 @@ class Extractor:
 
 	def extract_for_filters(self, tag_filters: List[str]) -> Dict[str, dict]:
 		print(f"Extracting: {tag_filters!r}")
-		manifest = self.packages["/Lotus/Types/Lore/PrimaryCodexManifest"]
-		entries = manifest.get("Entries", []) + manifest.get("AutoGeneratedEntries", [])
+		entries = self.get_codex_entries()
 
 		ret: Dict[str, dict] = {}
 
+		# Allocate all the new ids in one go
+		self.ids.allocate(
+			entry["type"] for entry in entries if "tag" in entry and entry["tag"] in tag_filters
+		)
+
 		for entry in entries:
 			if "tag" in entry and entry["tag"] in tag_filters:
 				key = entry["type"]
@@ -250,13 +505,22 @@ class Extractor:
 		return self.packages[key]
 
 	def extract_all(self) -> dict:
-		ret = {
-			"Mods": self.extract_for_filters(["Mod", "RelicsAndArcanes"]),
-			"Items": self.extract_for_filters(
-				["Sentinel", "SentinelWeapon", "Warframe", "Weapon"]
-			),
-			"ModSets": {},
-		}
+		# Codex entries and their parents make up the bulk of the parsing
+		keys = set()
+		for entry in self.get_codex_entries():
+			if entry.get("tag") in MOD_TAGS + ITEM_TAGS:
+				key = entry["type"]
+				while key in self.packages._packages and key not in keys:
+					keys.add(key)
+					key = self.packages._packages[key].parent_path
+		with stats.timer("extract.prefetch_time"):
+			self.prefetch(keys)
+
+		ret: Dict[str, Dict[str, dict]] = {"ModSets": {}}
+		with stats.timer("extract.mods_time"):
+			ret["Mods"] = self.extract_for_filters(MOD_TAGS)
+		with stats.timer("extract.items_time"):
+			ret["Items"] = self.extract_for_filters(ITEM_TAGS)
 
 		# Unknown key discovery
 		# Can't do this inside extract_for_filters() because it's cross-db.
@@ -271,40 +535,72 @@ class Extractor:
 			if item_compat not in self.all_keys:
 				self.orphans.add(item_compat)
 
-		self.process_orphans(ret["Items"])
+		with stats.timer("extract.orphans_time"):
+			self.process_orphans(ret["Items"])
 
 		# Clean exalted items so they're usable later…
-		for key in self.exalted_items:
-			item = ret["Items"][key]
-			if item["data"].get("ProductCategory", "") == "SpecialItems":
-				item["tag"] = "ExaltedItems"
-				obj = self.packages._packages[key]
-				# Iterate through parents
-				while obj.parent_path:
-					obj = self.packages._packages[obj.parent_path]
-					obj_data = obj.get_full_content(self.packages)
-					category = obj_data.get("ProductCategory", "")
-					# Find the first category that is not SpecialItems
-					if category and category != "SpecialItems":
-						item["data"]["ProductCategory"] = category
-						break
+		with stats.timer("extract.exalted_items_time"):
+			for key in self.exalted_items:
+				item = ret["Items"][key]
+				if item["data"].get("ProductCategory", "") == "SpecialItems":
+					item["tag"] = "ExaltedItems"
+					obj = self.packages._packages[key]
+					# Iterate through parents
+					while obj.parent_path:
+						obj = self.packages._packages[obj.parent_path]
+						obj_data = obj.get_full_content(self.packages)
+						category = obj_data.get("ProductCategory", "")
+						# Find the first category that is not SpecialItems
+						if category and category != "SpecialItems":
+							item["data"]["ProductCategory"] = category
+							break
 
 		# do modsets
-		for key in self.mod_sets:
-			ret["ModSets"][key] = self.get_mod_set(key)
+		with stats.timer("extract.mod_sets_time"):
+			for key in self.mod_sets:
+				ret["ModSets"][key] = self.get_mod_set(key)
 
 		return ret
 
 
 def main() -> None:
-	extractor = Extractor(sys.argv[1:])
+	parser = argparse.ArgumentParser()
+	parser.add_argument("bin_path")
+	parser.add_argument(
+		"--sqlite", metavar="DB",
+		help=f"Keep ids and extracted data in a SQLite database instead of {IDS_PATH} and {DATA_PATH}"
+	)
+	parser.add_argument(
+		"-j", "--jobs", type=int, default=os.cpu_count() or 1,
+		help="Number of processes used to parse packages (default: %(default)s)"
+	)
+	parser.add_argument(
+		"--manifest", metavar="PATH", default="",
+		help=(
+			"Local copy of the export manifest, downloaded to PATH if it does not exist. "
+			"It is never updated afterwards unless --refresh-manifest is passed"
+		)
+	)
+	parser.add_argument(
+		"--refresh-manifest", action="store_true",
+		help="Download the export manifest again, even if the --manifest copy exists"
+	)
+	parser.add_argument("--stats", metavar="PATH", help="Write a JSON stats report to PATH (- for stdout)")
+	parser.add_argument("--stats-top", type=int, default=10, help="Number of slowest packages to report")
+	args = parser.parse_args()
+
+	if args.stats:
+		collector = stats.enable(top=args.stats_top)
+
+	extractor = Extractor(args)
 	data = extractor.extract_all()
 
-	with open("ids.json", "w") as f:
-		json.dump(extractor.ids, f, indent="\t", sort_keys=True)
+	with stats.timer("extract.save_time"):
+		extractor.ids.save()
+		extractor.output.save(data)
 
-	with open(f"data.json", "w") as f:
-		json.dump(data, f, indent="\t", sort_keys=True, ensure_ascii=False)
+	if args.stats:
+		collector.write_report(args.stats)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,40 @@
+import struct
+
+from evoeng.cache_extract import TOC_MAGIC, TOC_RECORD
+
+
+# 2020-01-01T00:00:00Z
+TIMESTAMP = 132223104000000000
+
+
+class Archive:
+	"""
+	Builds a .toc and .cache pair in memory.
+	"""
+
+	def __init__(self) -> None:
+		self.toc = TOC_MAGIC + struct.pack("<i", 20)
+		self.cache = b""
+		self.directory_count = 0
+
+	def add_directory(self, parent: int, name: str) -> int:
+		"""
+		Add a directory to the directory at index `parent` (0 is the root)
+		and return its index.
+		"""
+		self.toc += TOC_RECORD.pack(-1, 0, 0, 0, 0, parent, name.encode())
+		self.directory_count += 1
+		return self.directory_count
+
+	def add_file(self, parent: int, name: str, data: bytes, timestamp: int = TIMESTAMP) -> None:
+		self.toc += TOC_RECORD.pack(len(self.cache), timestamp, len(data), len(data), 0, parent, name.encode())
+		self.cache += data
+
+	def write(self, path) -> str:
+		"""
+		Write T.toc and T.cache to the directory `path` and return the
+		path of T.cache.
+		"""
+		(path / "T.toc").write_bytes(self.toc)
+		(path / "T.cache").write_bytes(self.cache)
+		return str(path / "T.cache")
@@ -0,0 +1,77 @@
+import argparse
+import os
+
+import pytest
+from archive import Archive
+from evoeng.cache_extract import DirectoryTable, handle_files, handle_files_streaming, positive_int
+
+
+def make_archive():
+	archive = Archive()
+	lotus = archive.add_directory(0, "Lotus")
+	archive.add_file(lotus, "Sub", b"collides with the directory below")
+	sub = archive.add_directory(lotus, "Sub")
+	archive.add_file(sub, "A.png", b"first")
+	archive.add_file(sub, "A.png", b"duplicate")
+	archive.add_file(0, "Root.txt", b"root")
+	deeper = archive.add_directory(sub, "Deeper")
+	archive.add_file(deeper, "B.png", b"deep")
+	archive.add_file(deeper, "NoTime", b"skipped", timestamp=0)
+	return archive
+
+
+def read_tree(root):
+	ret = {}
+	for dirpath, dirnames, filenames in os.walk(root):
+		relpath = os.path.relpath(dirpath, root)
+		ret[relpath] = None
+		for filename in filenames:
+			path = os.path.join(dirpath, filename)
+			with open(path, "rb") as f:
+				ret[os.path.join(relpath, filename)] = (f.read(), os.path.getmtime(path))
+	return ret
+
+
+def extract(tmp_path, name, handler, **kwargs):
+	cache_path = make_archive().write(tmp_path)
+	outdir = str(tmp_path / name)
+	with open(cache_path, "rb") as cache_file, open(cache_path.replace(".cache", ".toc"), "rb") as toc_file:
+		handler(cache_file, toc_file, outdir, **kwargs)
+	return read_tree(outdir)
+
+
+@pytest.mark.parametrize("window_size", [1, 2, 4096])
+def test_streaming_matches_handle_files(tmp_path, window_size):
+	expected = extract(tmp_path, "default", handle_files)
+	assert expected[os.path.join("Lotus", "Sub~")][0] == b"collides with the directory below"
+	assert expected[os.path.join("Lotus", "Sub", "A.png")][0] == b"first"
+	assert len([path for path in expected if "A.png~" in path]) == 1
+	assert os.path.join("Lotus", "Sub", "Deeper", "NoTime") not in expected
+
+	assert extract(tmp_path, "streaming", handle_files_streaming, window_size=window_size) == expected
+
+
+@pytest.mark.parametrize("window_size", [0, -1])
+def test_streaming_invalid_window(tmp_path, window_size):
+	with pytest.raises(ValueError):
+		extract(tmp_path, "streaming", handle_files_streaming, window_size=window_size)
+	assert not (tmp_path / "streaming").exists()
+
+
+def test_positive_int():
+	assert positive_int("2") == 2
+	with pytest.raises(argparse.ArgumentTypeError):
+		positive_int("0")
+
+
+def test_directory_table():
+	directories = DirectoryTable()
+	assert directories.get_path(0) == "/"
+	lotus = directories.add(0, b"Lotus")
+	sub = directories.add(lotus, b"Sub")
+	assert directories.get_path(sub) == "/Lotus/Sub"
+	assert len(directories) == 3
+	with pytest.raises(KeyError):
+		directories.get_path(3)
+	with pytest.raises(KeyError):
+		directories.add(5, b"Orphan")
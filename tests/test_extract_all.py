@@ -0,0 +1,143 @@
+import argparse
+import json
+import os
+import sqlite3
+import sys
+
+from test_packages_extract import make_packages_file
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "scripts"))
+
+from extract_all import Extractor, SQLiteIdRegistry, SQLiteOutputStore  # noqa: E402
+
+
+def connect(path) -> sqlite3.Connection:
+	return sqlite3.connect(str(path), isolation_level=None)
+
+
+def test_id_registry_seed(tmp_path):
+	seed_path = tmp_path / "ids.json"
+	seed_path.write_text(json.dumps({"/Lotus/A": 1, "/Lotus/B": 5}))
+
+	registry = SQLiteIdRegistry(connect(tmp_path / "db.sqlite"), seed_path=str(seed_path))
+	assert registry.allocate(["/Lotus/B", "/Lotus/C", "/Lotus/A", "/Lotus/C"]) == {
+		"/Lotus/B": 5, "/Lotus/C": 6, "/Lotus/A": 1,
+	}
+
+
+def test_id_registries_share_ids(tmp_path):
+	registry1 = SQLiteIdRegistry(connect(tmp_path / "db.sqlite"))
+	registry2 = SQLiteIdRegistry(connect(tmp_path / "db.sqlite"))
+
+	ids1 = registry1.allocate(["/Lotus/A", "/Lotus/B"])
+	ids2 = registry2.allocate(["/Lotus/C", "/Lotus/A"])
+	ids1.update(registry1.allocate(["/Lotus/D", "/Lotus/C"]))
+
+	assert ids2["/Lotus/A"] == ids1["/Lotus/A"]
+	assert ids2["/Lotus/C"] == ids1["/Lotus/C"]
+	assert sorted(ids1.values()) == [1, 2, 3, 4]
+
+
+def test_output_store(tmp_path):
+	connection = connect(tmp_path / "db.sqlite")
+	store = SQLiteOutputStore(connection)
+
+	def get_rows():
+		return (
+			sorted(connection.execute("SELECT section, path, content FROM entries")),
+			sorted(connection.execute("SELECT path, parent FROM parents")),
+		)
+
+	data = {
+		"Mods": {
+			"/Lotus/A": {"path": "/Lotus/A", "parent": "/Lotus/Base", "data": {}},
+			"/Lotus/B": {"path": "/Lotus/B", "parent": "/Lotus/Base", "data": {}},
+		},
+		"ModSets": {"/Lotus/Set": {"NumUpgradesInSet": 6}},
+	}
+	store.save(data)
+	rows = get_rows()
+	assert len(rows[0]) == 3
+	assert rows[1] == [("/Lotus/A", "/Lotus/Base"), ("/Lotus/B", "/Lotus/Base")]
+
+	# Saving the same data again does not write anything
+	changes = connection.total_changes
+	store.save(data)
+	assert connection.total_changes == changes
+	assert get_rows() == rows
+
+	del data["Mods"]["/Lotus/B"]
+	data["ModSets"] = {}
+	data["Mods"]["/Lotus/A"]["data"] = {"A": 1}
+	store.save(data)
+	entries, parents = get_rows()
+	assert [(section, path) for section, path, _ in entries] == [("Mods", "/Lotus/A")]
+	assert json.loads(entries[0][2])["data"] == {"A": 1}
+	assert parents == [("/Lotus/A", "/Lotus/Base")]
+
+
+CODEX_PACKAGES = [
+	("/Lotus/Types/Lore/", "PrimaryCodexManifest", "", (
+		"\nEntries={\n"
+		"{\ntype=/Lotus/Mods/ModA\ntag=Mod\n},\n"
+		"{\ntype=/Lotus/Mods/ModB\ntag=Mod\n},\n"
+		"{\ntype=/Lotus/Items/Frame\ntag=Warframe\n}\n"
+		"}\n"
+	)),
+	("/Lotus/Mods/", "ModBase", "", "\nRarity=COMMON\nMesh=/Lotus/Mesh\n"),
+	("/Lotus/Mods/", "ModA", "ModBase", "\nItemCompatibility=/Lotus/Items/Orphan\nModSet=SetA\n"),
+	("/Lotus/Mods/", "ModB", "ModBase", "\nItemCompatibility=/Lotus/Items/Frame\n"),
+	("/Lotus/Mods/", "SetA", "", "\nNumUpgradesInSet=2\n"),
+	("/Lotus/Items/", "ItemBase", "", "\nProductCategory=Pistols\n"),
+	("/Lotus/Items/", "Frame", "ItemBase", "\nProductCategory=Suits\nAdditionalItems={\nExalted\n}\n"),
+	("/Lotus/Items/", "Exalted", "ItemBase", "\nProductCategory=SpecialItems\n"),
+	("/Lotus/Items/", "Orphan", "ItemBase", "\nHealth=100\n"),
+]
+
+
+def run_extractor(path, jobs):
+	# ids.json is looked up in the working directory
+	with open(os.path.join(path, "ids.json"), "w") as f:
+		json.dump({"/Lotus/Mods/ModB": 10}, f)
+	with open(os.path.join(path, "manifest.json"), "w") as f:
+		json.dump({"Manifest": [
+			{"uniqueName": "/Lotus/Items/Frame", "textureLocation": "\\Lotus\\Frame.png!00_hash"},
+		]}, f)
+	with open(os.path.join(path, "packages.bin"), "wb") as f:
+		f.write(make_packages_file(CODEX_PACKAGES).getvalue())
+
+	args = argparse.Namespace(
+		bin_path=os.path.join(path, "packages.bin"), sqlite=None, jobs=jobs,
+		manifest=os.path.join(path, "manifest.json"), refresh_manifest=False,
+	)
+	extractor = Extractor(args)
+	data = extractor.extract_all()
+	# Prefetched content must all have been consumed
+	assert extractor._parse_cache == {}
+	return data, extractor.ids.ids
+
+
+def test_extract_all_jobs(tmp_path, monkeypatch):
+	results = []
+	for jobs in (1, 4):
+		path = tmp_path / str(jobs)
+		path.mkdir()
+		monkeypatch.chdir(path)
+		results.append(run_extractor(str(path), jobs))
+
+	(data, ids), (data4, ids4) = results
+	assert data4 == data
+	assert ids4 == ids
+
+	assert sorted(data["Mods"]) == ["/Lotus/Mods/ModA", "/Lotus/Mods/ModB", "/Lotus/Mods/ModBase"]
+	assert data["Mods"]["/Lotus/Mods/ModA"]["data"] == {
+		"Rarity": "COMMON", "ItemCompatibility": "/Lotus/Items/Orphan", "ModSet": "/Lotus/Mods/SetA",
+	}
+	assert data["Mods"]["/Lotus/Mods/ModB"]["id"] == 10
+	assert data["Items"]["/Lotus/Items/Frame"]["texture"] == "/Lotus/Frame.png!00_hash"
+	# ItemCompatibility orphans and parents are extracted with the items
+	assert {"/Lotus/Items/Orphan", "/Lotus/Items/ItemBase"} <= data["Items"].keys()
+	exalted = data["Items"]["/Lotus/Items/Exalted"]
+	assert exalted["tag"] == "ExaltedItems"
+	assert exalted["data"]["ProductCategory"] == "Pistols"
+	assert data["ModSets"] == {"/Lotus/Mods/SetA": {"NumUpgradesInSet": 2}}
@@ -42,3 +42,71 @@ PACKAGES = {
 )
 def test_package_correct_structure(package_text, expected_value):
 	assert package_parser.loads("\n" + package_text + "\n") == expected_value
+
+
+FILTERED_PACKAGE = """
+A=1
+Mesh={
+Foo="{,}"
+Bar={1,2,3}
+}
+B={
+C=RawString
+}
+D="quoted
+string"
+"""
+
+
+def test_loads_exclude():
+	assert package_parser.loads(FILTERED_PACKAGE, exclude={"Mesh"}) == {
+		"A": 1,
+		"B": {"C": "RawString"},
+		"D": "quoted\nstring",
+	}
+
+
+def test_loads_include():
+	assert package_parser.loads(FILTERED_PACKAGE, include={"A", "Mesh"}) == {
+		"A": 1,
+		"Mesh": {"Foo": "{,}", "Bar": [1, 2, 3]},
+	}
+	assert package_parser.loads(FILTERED_PACKAGE, include=set()) == {}
+
+
+@pytest.mark.parametrize("package_text", ["A={\n", "A=1\n\nB=2\n", "\nA=1\n \nB=2\n"])
+def test_loads_filtered_invalid(package_text):
+	with pytest.raises(Exception):
+		package_parser.loads(package_text)
+	with pytest.raises(Exception):
+		package_parser.loads(package_text, exclude={"X"})
+
+
+def test_loads_compact():
+	text = "\nA={\nPath=/Lotus/Foo\n}\nB=/Lotus/Foo\n"
+	assert package_parser.loads(text, compact=True) == package_parser.loads(text)
+
+	a = package_parser.loads(text, compact=True)
+	b = package_parser.loads(text, compact=True)
+	assert a["B"] is b["B"] is a["A"]["Path"]
+
+
+@pytest.mark.parametrize(
+	"package_text",
+	packages + ["\n" + text + "\n" for text in PACKAGES] + [FILTERED_PACKAGE],
+)
+def test_to_json(package_text):
+	assert json.loads(package_parser.to_json(package_text)) == package_parser.loads(package_text)
+
+
+@pytest.mark.parametrize("package_text", ["A\n", "A={\n", "A=1\n\nB=2\n", 'A="foo\n'])
+def test_to_json_invalid(package_text):
+	with pytest.raises(package_parser.TranscodeError):
+		package_parser.to_json(package_text)
+
+
+def test_transcode_writes_incrementally():
+	chunks = []
+	package_parser.transcode(FILTERED_PACKAGE, chunks.append)
+	assert len(chunks) > 1
+	assert json.loads("".join(chunks)) == package_parser.loads(FILTERED_PACKAGE)
@@ -0,0 +1,81 @@
+import json
+import struct
+from io import BytesIO
+
+import pytest
+from evoeng.packages_extract import LayeredContent, PackagesFile, json_default
+
+
+def length_prefixed(s: str) -> bytes:
+	return struct.pack("<i", len(s)) + s.encode()
+
+
+def make_packages_file(packages) -> BytesIO:
+	"""
+	Build a packages file from (base_path, name, parent_name, text) tuples.
+	"""
+	data = b"\0" * 29 + struct.pack("<i", 0)
+	chunks = b"".join(text.encode() + b"\0" for _, _, _, text in packages)
+	data += struct.pack("<i", len(chunks)) + chunks + struct.pack("<i", len(packages))
+	for base_path, name, parent_name, _ in packages:
+		data += length_prefixed(base_path) + length_prefixed(name) + b"\0" * 5
+		data += length_prefixed(parent_name) + b"\0" * 4
+	return BytesIO(data)
+
+
+PACKAGES = [
+	("/Lotus/", "Base", "", "\nA=1\nL={\nX=/Lotus/Path\n}\n"),
+	("/Lotus/", "Child", "Base", "\nB=2\n"),
+	("/Lotus/", "GrandChild", "Child", "\nA=3\n"),
+]
+
+
+@pytest.mark.parametrize("compact", [False, True])
+def test_inheritance(compact):
+	packages = PackagesFile(make_packages_file(PACKAGES), compact=compact)
+	assert dict(packages["/Lotus/Base"]) == {"A": 1, "L": {"X": "/Lotus/Path"}}
+	assert dict(packages["/Lotus/Child"]) == {"A": 1, "L": {"X": "/Lotus/Path"}, "B": 2}
+	assert dict(packages["/Lotus/GrandChild"]) == {"A": 3, "L": {"X": "/Lotus/Path"}, "B": 2}
+
+
+def test_compact_layers():
+	packages = PackagesFile(make_packages_file(PACKAGES), compact=True)
+	content = packages["/Lotus/GrandChild"]
+	assert isinstance(content, LayeredContent)
+	assert list(content) == ["A", "L", "B"]
+
+	# Parents are parsed once and shared between children
+	assert packages._content_cache[("/Lotus/Child", None, None)].maps[1] is (
+		packages._content_cache[("/Lotus/Base", None, None)].maps[0]
+	)
+
+	# Shared values are handed out as read-only views, never copied
+	assert content["L"] is packages["/Lotus/Base"]["L"]
+	with pytest.raises(TypeError):
+		content["A"] = 4
+	with pytest.raises(TypeError):
+		content["L"]["X"] = "modified"
+	assert packages["/Lotus/Base"]["L"] == {"X": "/Lotus/Path"}
+
+	assert json.loads(json.dumps(content, default=json_default)) == {
+		"A": 3, "L": {"X": "/Lotus/Path"}, "B": 2
+	}
+	assert content.to_dict() == {"A": 3, "L": {"X": "/Lotus/Path"}, "B": 2}
+
+
+def test_compact_lists_are_tuples():
+	packages = PackagesFile(make_packages_file([
+		("/Lotus/", "Base", "", "\nL={1,2}\nD={\nM={3}\n}\n"),
+	]), compact=True)
+	content = packages["/Lotus/Base"]
+	assert content["L"] == (1, 2)
+	assert content["D"]["M"] == (3, )
+	assert json.dumps(content, default=json_default) == '{"L": [1, 2], "D": {"M": [3]}}'
+
+
+def test_write_json():
+	packages = PackagesFile(make_packages_file(PACKAGES))
+	chunks = []
+	packages._packages["/Lotus/Base"].write_json(chunks.append)
+	assert len(chunks) > 1
+	assert json.loads("".join(chunks)) == {"A": 1, "L": {"X": "/Lotus/Path"}}
@@ -0,0 +1,48 @@
+import subprocess
+import sys
+import time
+
+import pytest
+
+
+def get_imported_modules(module: str) -> set:
+	code = f"import sys, {module}; print(' '.join(sys.modules))"
+	output = subprocess.check_output([sys.executable, "-c", code], text=True)
+	return set(output.split())
+
+
+@pytest.mark.parametrize("module", [
+	"evoeng.cache_extract",
+	"evoeng.package_parser",
+	"evoeng.packages_extract",
+	"evoeng.texture_extract",
+])
+def test_import_is_lightweight(module):
+	modules = get_imported_modules(module)
+	assert "parsimonious" not in modules
+	assert "requests" not in modules
+
+
+def test_grammar_is_compiled_lazily():
+	from evoeng import package_parser
+
+	package_parser.get_grammar.cache_clear()
+	assert package_parser.get_grammar.cache_info().currsize == 0
+	package_parser.loads("A=1\n")
+	assert package_parser.get_grammar.cache_info().currsize == 1
+	assert package_parser.GRAMMAR is package_parser.get_grammar()
+
+
+def get_startup_time(code: str, runs: int = 5) -> float:
+	ret = float("inf")
+	for _ in range(runs):
+		start = time.perf_counter()
+		subprocess.check_call([sys.executable, "-c", code])
+		ret = min(ret, time.perf_counter() - start)
+	return ret
+
+
+def test_startup_time():
+	# Best of several runs, compared to a bare interpreter with a generous budget
+	baseline = get_startup_time("pass")
+	assert get_startup_time("import evoeng.cache_extract") - baseline < 0.5
@@ -0,0 +1,62 @@
+from evoeng import stats
+
+
+def test_disabled():
+	stats.disable()
+	assert stats.get_collector() is None
+	stats.incr("a")
+	with stats.timer("b") as timer:
+		assert timer is None
+
+
+def test_report():
+	collector = stats.enable(top=2)
+	events = []
+	collector.add_callback(lambda name, label, value: events.append((name, label, value)))
+	try:
+		stats.incr("cache.bytes_read", 10)
+		stats.incr("cache.bytes_written", 25)
+		for label, value in (("small", 1), ("large", 3), ("medium", 2)):
+			stats.observe("size", label, value)
+		with stats.timer("time", "slow"):
+			pass
+	finally:
+		stats.disable()
+
+	report = collector.report()
+	assert report["counters"] == {"cache.bytes_read": 10, "cache.bytes_written": 25}
+	assert report["derived"]["cache.compression_ratio"] == 2.5
+	assert report["observations"]["size"] == {"count": 3, "total": 6, "mean": 2, "max": 3}
+	assert [o["label"] for o in report["largest"]["size"]] == ["large", "medium"]
+	assert report["largest"]["time"][0]["label"] == "slow"
+	assert events[0] == ("cache.bytes_read", "", 10)
+	assert len(events) == 6
+
+
+def test_largest_unique_labels():
+	collector = stats.Collector(top=2)
+	for label, value in (("base", 1), ("base", 5), ("a", 2), ("base", 3), ("b", 4), ("c", 0.5)):
+		collector.observe("time", label, value)
+
+	assert [(o["label"], o["value"]) for o in collector.report()["largest"]["time"]] == [
+		("base", 5), ("b", 4)
+	]
+
+
+def test_merge():
+	collector = stats.Collector(top=2)
+	collector.incr("count", 1)
+	collector.observe("time", "a", 1)
+
+	worker = stats.Collector(top=2)
+	worker.add_callback(lambda *args: None)
+	worker.incr("count", 2)
+	worker.observe("time", "b", 3)
+	worker.observe("time", "a", 2)
+
+	collector.merge(worker)
+	report = collector.report()
+	assert report["counters"] == {"count": 3}
+	assert report["observations"]["time"] == {"count": 3, "total": 6, "mean": 2, "max": 3}
+	assert [(o["label"], o["value"]) for o in report["largest"]["time"]] == [("b", 3), ("a", 2)]
+	assert worker.__getstate__()["callbacks"] == []
@@ -0,0 +1,98 @@
+import os
+
+from archive import TIMESTAMP, Archive
+from evoeng import stats, texture_extract
+
+
+SECONDS = 10 ** 7
+
+
+def write_archive(tmp_path, files):
+	"""
+	Write T.toc and T.cache with (name, data, timestamp) files in /Lotus/Icons.
+	"""
+	archive = Archive()
+	icons = archive.add_directory(archive.add_directory(0, "Lotus"), "Icons")
+	for name, data, timestamp in files:
+		archive.add_file(icons, name, data, timestamp)
+	return archive.write(tmp_path)
+
+
+def read(outdir, name):
+	with open(os.path.join(outdir, "Lotus", "Icons", name), "rb") as f:
+		return f.read()
+
+
+def test_references():
+	manifest = {"Manifest": [
+		{"uniqueName": "/Lotus/A", "textureLocation": "\\Lotus\\Icons\\A.png!00_abc"},
+		{"uniqueName": "/Lotus/B", "textureLocation": ""},
+	]}
+	assert texture_extract.get_manifest_references(manifest) == {"/Lotus/Icons/A.png"}
+
+	collection = {"Icons": [{"Name": "X", "Platforms": [{"Material": "/Lotus/Icons/X.material"}, {}]}]}
+	assert texture_extract.get_icon_references(collection) == {"/Lotus/Icons/X.material"}
+
+
+def test_extract_references(tmp_path):
+	cache_path = write_archive(tmp_path, [
+		("A.png", b"aaa", TIMESTAMP),
+		("B.png", b"bbb", TIMESTAMP),
+	])
+	outdir = str(tmp_path / "out")
+	references = {"/Lotus/Icons/A.png", "/Lotus/Icons/C.png"}
+
+	found = texture_extract.extract_references([cache_path], references, outdir)
+	assert list(found) == ["/Lotus/Icons/A.png"]
+	assert read(outdir, "A.png") == b"aaa"
+	assert not os.path.exists(os.path.join(outdir, "Lotus", "Icons", "B.png"))
+
+	# Unchanged entries are not extracted again
+	local_path = found["/Lotus/Icons/A.png"]
+	with open(local_path, "wb") as f:
+		f.write(b"modified")
+	os.utime(local_path, (1577836800, 1577836800))
+	texture_extract.extract_references([cache_path], references, outdir)
+	assert read(outdir, "A.png") == b"modified"
+
+
+def test_duplicate_entries(tmp_path):
+	cache_path = write_archive(tmp_path, [
+		("A.png", b"new", TIMESTAMP + SECONDS),
+		("A.png", b"old", TIMESTAMP),
+	])
+	outdir = str(tmp_path / "out")
+	references = {"/Lotus/Icons/A.png"}
+
+	collector = stats.enable()
+	try:
+		texture_extract.extract_references([cache_path], references, outdir)
+		assert read(outdir, "A.png") == b"new"
+		assert collector.counters["textures.extracted"] == 1
+
+		# The newest entry is already there, nothing to do
+		texture_extract.extract_references([cache_path], references, outdir)
+		assert read(outdir, "A.png") == b"new"
+		assert collector.counters["textures.extracted"] == 1
+		assert collector.counters["textures.up_to_date"] == 1
+	finally:
+		stats.disable()
+
+
+def test_extract_textures_from_materials(tmp_path):
+	material = b"\nDiffuseTexture=/Lotus/Icons/A.png!00_abc\nMask=B.png\nName=NotATexture\n"
+	cache_path = write_archive(tmp_path, [
+		("X.material", material, TIMESTAMP),
+		("A.png", b"aaa", TIMESTAMP),
+		("B.png", b"bbb", TIMESTAMP),
+		("Unused.png", b"unused", TIMESTAMP),
+	])
+	outdir = str(tmp_path / "out")
+	references = {"/Lotus/Icons/X.material", "/Lotus/Icons/Missing.material"}
+
+	missing = texture_extract.extract_textures([cache_path], references, outdir, jobs=2)
+	assert missing == {"/Lotus/Icons/Missing.material"}
+	assert read(outdir, "X.material") == material
+	assert read(outdir, "A.png") == b"aaa"
+	assert read(outdir, "B.png") == b"bbb"
+	assert not os.path.exists(os.path.join(outdir, "Lotus", "Icons", "Unused.png"))